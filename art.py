@@ -16,9 +16,15 @@ import urllib.error
 import urllib.parse
 import urllib.request
 import json
-from typing import Tuple, List
+import codecs
+import heapq
+from typing import Any, Tuple, List, Dict, Optional, Iterable, Iterator, NamedTuple, BinaryIO
 from re import fullmatch
 from random import choice
+import os
+import sys
+
+from PIL import Image
 
 from simpleimage import SimpleImage
 
@@ -74,31 +80,138 @@ def build_url(start_date: str, end_date: str) -> str:
         ('end_date', end_date)
     ])
 
+class Apod(NamedTuple):
+    """The fields of an APOD entry the program actually uses"""
+    url: str
+    media_type: str
+    explanation: str
+
+# Helper function to parse a JSON array one element at a time
+def iter_json_array(stream: BinaryIO, chunk_size: int=1 << 16) -> Iterator[Any]:
+    """
+    Incrementally decode a top-level JSON array as it is read
+
+    Parameters:
+        stream: binary file-like object, e.g. an HTTP response
+        chunk_size: bytes read at a time
+
+    Returns:
+        generator of the array's elements
+
+    Raises:
+        json.JSONDecodeError: the body is not a single, complete JSON array
+    """
+
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    # what the next non-whitespace character may be
+    expecting = '['
+    done = False
+
+    while not done:
+        chunk = stream.read(chunk_size)
+        done = not chunk
+        buffer = buffer[position:] + text_decoder.decode(chunk, final=done)
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n':
+                position += 1
+            if position == len(buffer):
+                break
+
+            character = buffer[position]
+
+            if expecting == '[':
+                if character != '[':
+                    raise json.JSONDecodeError("Expecting '['", buffer, position)
+                expecting = 'value or ]'
+                position += 1
+
+            elif expecting == 'value or ]' and character == ']':
+                expecting = 'end'
+                position += 1
+
+            elif expecting in ('value', 'value or ]'):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as error:
+                    if done or not _is_truncated(error, buffer):
+                        raise
+                    break # element is split across chunks, wait for more
+
+                # a number followed only by number characters might continue, e.g. 12|34 or 1.|5
+                if not done and fullmatch(_NUMBER_TAIL, buffer[end:]):
+                    break
+
+                yield item
+                expecting = ', or ]'
+                position = end
+
+            elif expecting == ', or ]' and character in ',]':
+                expecting = 'value' if character == ',' else 'end'
+                position += 1
+
+            elif expecting == 'end':
+                raise json.JSONDecodeError('Extra data', buffer, position)
+
+            else:
+                raise json.JSONDecodeError(f"Expecting {expecting}", buffer, position)
+
+    if expecting != 'end':
+        raise json.JSONDecodeError(f"Expecting {expecting}", buffer, position)
+
+# what can follow a number that has been cut short, e.g. the '.5' of 1|.5
+_NUMBER_TAIL = r'[0-9.eE+-]*'
+
+# constants json accepts, any of which may be cut short at the end of a read
+_JSON_CONSTANTS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+def _is_truncated(error: json.JSONDecodeError, buffer: str) -> bool:
+    """Whether a decoding error could be fixed by reading more data"""
+    # strings are reported where they start, so an open one is always a cut
+    if error.msg.startswith('Unterminated string'):
+        return True
+
+    # anything else is reported where the unreadable part starts, which for a cut
+    # value is the unread tail: nothing, part of a number, a constant or a \uXXXX escape
+    tail = buffer[error.pos:]
+    return bool(
+        fullmatch(_NUMBER_TAIL, tail) or
+        fullmatch(r'u[0-9a-fA-F]{0,4}', tail) or
+        any(constant.startswith(tail) for constant in _JSON_CONSTANTS)
+    )
+
 # Function to get results from the NASA APOD API
-def get_result(url: str) -> List[dict]:
+def get_result(url: str) -> Iterator[Apod]:
     """
-    Send the request to NASA’s APOD API, retrieve, and parse the results.
+    Send the request to NASA’s APOD API, retrieve, and parse the results as they arrive.
     
     Parameters:
         url: request
+
+    Returns:
+        generator of results
     """
 
     try:
         with urllib.request.urlopen(url) as response:
-            read = response.read()
-            data = json.loads(read)
-            return data
+            for item in iter_json_array(response):
+                # keep only the fields that are used, the rest is dropped straight away
+                yield Apod(item.get('url', ''), item.get('media_type', ''), item.get('explanation', ''))
 
     except urllib.error.HTTPError:
-        return []
+        return
 
 # Function to score and filter results based on query
-def search_description(search_result: List[dict], query: str, max: int=2) -> List[str]:
+def search_description(search_result: Iterable[Apod], query: str, max: int=2) -> List[str]:
     """
     Pick the most fitting images based on the query
     
     Parameters:
-        search_result: list of results
+        search_result: results, possibly still streaming in
         query: search query
         max: maximum number of results
     
@@ -108,29 +221,30 @@ def search_description(search_result: List[dict], query: str, max: int=2) -> Lis
 
     scores = {}
     keywords = query.lower().split()
-    images = filter(lambda x: x['media_type'] == 'image', search_result)
+    images = filter(lambda x: x.media_type == 'image', search_result)
 
+    # only urls and scores are kept, each explanation is dropped once scored
     for item in images:
         score = 0
         for keyword in keywords:
-            if keyword in item['explanation'].lower():
+            if keyword in item.explanation.lower():
                 score += 1
-        scores[item['url']] = score
+        scores[item.url] = score
 
-    scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return [url for url, _ in scores[:max]]
+    # same as a stable sort, so ties favour earlier results
+    return [url for url, _ in heapq.nlargest(max, scores.items(), key=lambda x: x[1])]
 
 # Function to download images based on the filtered results
-def get_images(urls: List[str]) -> None:
+def get_images(urls: List[str], prefix: str='image') -> None:
     """
-    Download images as imageN.jpg for N URLs.
+    Download images as {prefix}N.jpg for N URLs.
     """
 
     for i, url in enumerate(urls):
-        urllib.request.urlretrieve(url, f'image{i + 1}.jpg')
+        urllib.request.urlretrieve(url, f'{prefix}{i + 1}.jpg')
 
 # Function to apply transformations and return a list of transformed images
-def get_transforms(file1: str, file2: str) -> List[SimpleImage]:
+def get_transforms(file1: str, file2: str, save: bool=True) -> List[SimpleImage]:
     """
     Shrink (1/5) and apply 11 transformations to the first image using
     the second image as a background, mostly
@@ -138,6 +252,7 @@ def get_transforms(file1: str, file2: str) -> List[SimpleImage]:
     Parameters:
         file1: main image
         file2: background image
+        save: whether to write the filter examples to filter-images/
 
     Returns:
         list of original image and 11 transformed
@@ -150,12 +265,13 @@ def get_transforms(file1: str, file2: str) -> List[SimpleImage]:
     background_image = secondary_image.shrink(5)
 
     # save filtered images
-    shrunk_main_image.grayscale().write('filter-images/grayscale.jpg')
-    shrunk_main_image.sepia().write('filter-images/sepia.jpg')
-    shrunk_main_image.blur().write('filter-images/blur.jpg')
-    shrunk_main_image.filter('red', 100).write('filter-images/red.jpg')
-    shrunk_main_image.flip(0).write('filter-images/flip.jpg')
-    shrunk_main_image.greenscreen('red', 100, background_image).write('filter-images/greenscreen.jpg')
+    if save:
+        shrunk_main_image.grayscale().write('filter-images/grayscale.jpg')
+        shrunk_main_image.sepia().write('filter-images/sepia.jpg')
+        shrunk_main_image.blur().write('filter-images/blur.jpg')
+        shrunk_main_image.filter('red', 100).write('filter-images/red.jpg')
+        shrunk_main_image.flip(0).write('filter-images/flip.jpg')
+        shrunk_main_image.greenscreen('red', 100, background_image).write('filter-images/greenscreen.jpg')
 
     return [
         shrunk_main_image,
@@ -198,6 +314,148 @@ def compose(img_list: List[SimpleImage]) -> SimpleImage:
 
     return collage
 
+# Helper function to average the colour of an image
+def average_color(image: SimpleImage) -> Tuple[int, int, int]:
+    """
+    Average RGB colour of the whole image
+
+    Returns:
+        (red, green, blue)
+    """
+
+    # a box-filtered 1x1 resize averages every pixel in C
+    return image.pil_image.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+class ColorTree:
+    """
+    KD-tree over RGB colours for nearest-colour lookups
+
+    Each distinct colour is stored once, so libraries full of identical averages
+    (e.g. flipped stamps) don't degrade the search into a linear scan.
+    Nodes are (color, left, right) tuples split on red, green, blue in turn.
+    """
+
+    def __init__(self, colors: List[Tuple[int, int, int]]):
+        # distinct colour -> indices of every item with that colour
+        self.indices: Dict[Tuple[int, int, int], List[int]] = {}
+        for index, color in enumerate(colors):
+            self.indices.setdefault(tuple(color), []).append(index)
+
+        self.root = self._build(list(self.indices), 0)
+
+    def _build(self, colors: List[Tuple[int, int, int]], depth: int) -> Optional[tuple]:
+        """Recursively split colours on the median of the current axis"""
+        if not colors:
+            return None
+
+        axis = depth % 3
+        colors.sort(key=lambda color: color[axis])
+        middle = len(colors) // 2
+
+        return (
+            colors[middle],
+            self._build(colors[:middle], depth + 1),
+            self._build(colors[middle + 1:], depth + 1)
+        )
+
+    def nearest(self, color: Tuple[int, int, int]) -> int:
+        """
+        Find the closest colour in the tree
+
+        Parameters:
+            color: (red, green, blue) to match
+
+        Returns:
+            index of the closest colour in the list the tree was built from,
+            picked at random when several items share that colour
+        """
+
+        best_color = None
+        best_distance = float('inf')
+        # (node, depth, squared distance to the node's region) stack instead of recursion
+        stack = [(self.root, 0, 0)]
+
+        while stack:
+            node, depth, reach = stack.pop()
+            # checked on pop so the best found so far prunes as much as possible
+            if node is None or reach >= best_distance:
+                continue
+
+            node_color, left, right = node
+            distance = (
+                (node_color[0] - color[0]) ** 2 +
+                (node_color[1] - color[1]) ** 2 +
+                (node_color[2] - color[2]) ** 2
+            )
+            if distance < best_distance:
+                best_distance = distance
+                best_color = node_color
+
+            axis = depth % 3
+            difference = color[axis] - node_color[axis]
+            near, far = (left, right) if difference < 0 else (right, left)
+
+            # far side first so the near side is searched first
+            stack.append((far, depth + 1, max(reach, difference ** 2)))
+            stack.append((near, depth + 1, reach))
+
+        return choice(self.indices[best_color])
+
+# Function to index stamps by colour for the photomosaic
+def build_library(img_list: List[SimpleImage], tile_width: int=8, tile_height: Optional[int]=None) -> Tuple[List[SimpleImage], ColorTree]:
+    """
+    Shrink every stamp to a tile and index the tiles by average colour
+
+    Parameters:
+        img_list: stamps, e.g. transformations from several APOD images
+        tile_width: width of each tile in pixels
+        tile_height: height of each tile in pixels, by default keeping the first stamp's shape
+
+    Returns:
+        (tiles, colour index over the tiles)
+    """
+
+    if tile_height is None:
+        tile_height = max(1, round(tile_width * img_list[0].height / img_list[0].width))
+
+    # stamps of other shapes are cropped around the centre rather than stretched
+    tiles = [image.fit(tile_width, tile_height) for image in img_list]
+
+    return tiles, ColorTree([average_color(tile) for tile in tiles])
+
+# Function to compose a photomosaic of a target image
+def photomosaic(target: SimpleImage, tiles: List[SimpleImage], tree: ColorTree, columns: int=100, rows: Optional[int]=None) -> SimpleImage:
+    """
+    Split the target into a grid and fill each cell with the closest coloured tile
+
+    Parameters:
+        target: image to recreate
+        tiles: tiles from build_library
+        tree: colour index from build_library
+        columns: number of cells across
+        rows: number of cells down, by default keeping the target's shape
+
+    Returns:
+        the mosaic
+    """
+
+    tile_width = tiles[0].width
+    tile_height = tiles[0].height
+    if rows is None:
+        rows = max(1, round(columns * target.height * tile_width / (target.width * tile_height)))
+
+    mosaic = SimpleImage.blank(columns * tile_width, rows * tile_height)
+
+    # averaging every cell at once is the same as shrinking to one pixel per cell
+    cells = target.pil_image.resize((columns, rows), Image.Resampling.BOX).load()
+
+    for column in range(columns):
+        for row in range(rows):
+            tile = tiles[tree.nearest(cells[column, row])]
+            mosaic.pil_image.paste(tile.pil_image, (column * tile_width, row * tile_height))
+
+    return mosaic
+
 # Main function to run the complete process
 def run():
     """Default run of the program as specified in the project"""
@@ -211,5 +469,32 @@ def run():
     collage.show()
     collage.write('image3.jpg')
 
+def run_mosaic():
+    """Photomosaic of the first image built from the transformations of every downloaded image"""
+    start_date, end_date, query = get_inputs()
+    url = build_url(start_date, end_date)
+    search_result = get_result(url)
+    urls = search_description(search_result, query, max=10)
+    if not urls:
+        print('No images found.')
+        return
+
+    # kept apart from image1.jpg... so the collage files aren't overwritten
+    os.makedirs('mosaic-images', exist_ok=True)
+    get_images(urls, 'mosaic-images/image')
+
+    files = [f'mosaic-images/image{i + 1}.jpg' for i in range(len(urls))]
+    stamps = []
+    for i, file in enumerate(files):
+        stamps += get_transforms(file, files[(i + 1) % len(files)], save=False)
+
+    tiles, tree = build_library(stamps)
+    mosaic = photomosaic(SimpleImage(files[0]), tiles, tree)
+    mosaic.show()
+    mosaic.write('mosaic.jpg')
+
 if __name__ == '__main__':
-    run()
+    if sys.argv[1:] == ['mosaic']:
+        run_mosaic()
+    else:
+        run()
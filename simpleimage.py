@@ -35,7 +35,7 @@ The main() function below demonstrates the above functions as a test.
 
 import sys
 # If the following line fails, "Pillow" needs to be installed
-from PIL import Image
+from PIL import Image, ImageOps
 
 
 def clamp(num):
@@ -246,6 +246,13 @@ class SimpleImage():
         self._width = size[0]
         self._height = size[1]
 
+    def fit(self, width, height):
+        """Returns a copy cropped around the centre to the given shape and resized to it"""
+        fitted = SimpleImage.blank(width, height)
+        fitted.pil_image = ImageOps.fit(self.pil_image, (width, height))
+        fitted.px = fitted.pil_image.load()
+        return fitted
+
     def write(self, path):
         """Write image to file"""
         self.pil_image.save(path)
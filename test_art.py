@@ -0,0 +1,175 @@
+"""
+test_art.py
+
+Tests for the photomosaic and streaming helpers in art.py
+
+Run with: python -m pytest
+"""
+
+import io
+import json
+from random import Random
+
+import pytest
+
+from art import Apod, ColorTree, build_library, photomosaic, iter_json_array, search_description
+from simpleimage import SimpleImage
+
+
+def squared_distance(a, b):
+    return sum((x - y) ** 2 for x, y in zip(a, b))
+
+def solid(color, width=4, height=4):
+    image = SimpleImage.blank(width, height)
+    image.pil_image.paste(color, (0, 0, width, height))
+    return image
+
+def check_nearest(colors, queries):
+    """ColorTree.nearest should match a linear scan for every query"""
+    tree = ColorTree(colors)
+    for query in queries:
+        index = tree.nearest(query)
+        best = min(squared_distance(color, query) for color in colors)
+        assert squared_distance(colors[index], query) == best
+
+def test_nearest_random_colors():
+    random = Random(0)
+    colors = [tuple(random.randrange(256) for _ in range(3)) for _ in range(500)]
+    queries = [tuple(random.randrange(256) for _ in range(3)) for _ in range(300)]
+    check_nearest(colors, queries)
+
+def test_nearest_duplicate_colors():
+    random = Random(1)
+    distinct = [tuple(random.randrange(256) for _ in range(3)) for _ in range(20)]
+    colors = [random.choice(distinct) for _ in range(1000)]
+    queries = [tuple(random.randrange(256) for _ in range(3)) for _ in range(300)]
+    check_nearest(colors, queries)
+
+    tree = ColorTree([(10, 10, 10)] * 50)
+    assert 0 <= tree.nearest((200, 0, 0)) < 50
+
+def test_nearest_single_point():
+    tree = ColorTree([(1, 2, 3)])
+    assert tree.nearest((255, 255, 255)) == 0
+    assert tree.nearest((1, 2, 3)) == 0
+
+def test_photomosaic_places_closest_tiles():
+    red, green, blue = (255, 0, 0), (0, 255, 0), (0, 0, 255)
+    tiles, tree = build_library([solid(red), solid(green), solid(blue)], 2, 3)
+
+    # 3x2 target, one cell per pixel
+    target = SimpleImage.blank(3, 2)
+    cells = [[red, green, blue], [(0, 0, 200), (200, 10, 10), (10, 220, 10)]]
+    for y, row in enumerate(cells):
+        for x, color in enumerate(row):
+            target.set_rgb(x, y, *color)
+
+    mosaic = photomosaic(target, tiles, tree, columns=3, rows=2)
+    assert (mosaic.width, mosaic.height) == (6, 6)
+
+    expected = [[red, green, blue], [blue, red, green]]
+    for y, row in enumerate(expected):
+        for x, color in enumerate(row):
+            cell = mosaic.pil_image.crop((x * 2, y * 3, x * 2 + 2, y * 3 + 3))
+            assert set(cell.getdata()) == {color}
+
+def parse(raw, chunk_size):
+    return list(iter_json_array(io.BytesIO(raw), chunk_size))
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 1 << 16])
+def test_iter_json_array_chunk_boundaries(chunk_size):
+    items = [
+        {'url': 'a', 'explanation': 'café ✨ 🌌 "quoted" \\ \u00e9', 'n': -1.5e-3},
+        12345,
+        1.5,
+        -12.25,
+        1.5e-3,
+        -2E+10,
+        0,
+        'text',
+        True,
+        None,
+        [1, [2, 3]],
+        {},
+    ]
+    for raw in (json.dumps(items), json.dumps(items, ensure_ascii=False, indent=2)):
+        assert parse(raw.encode(), chunk_size) == items
+
+    assert parse(b'[1, 23, 456]', chunk_size) == [1, 23, 456]
+    assert parse(b'[1.5]', chunk_size) == [1.5]
+    assert parse(b'[1.5e-3, 2]', chunk_size) == [1.5e-3, 2]
+    assert parse(b'[-12.25,-Infinity,NaN]', chunk_size)[:2] == [-12.25, float('-inf')]
+    assert parse(b'["\\u00e9\\u00e9"]', chunk_size) == ['\u00e9\u00e9']
+    assert parse(b' [ ] ', chunk_size) == []
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    b'{"error": "bad key"}',
+    b'[{"a": 1}, {"b": 2}',
+    b'[{"a": 1}, {"b": 2',
+    b'[1, 2,',
+    b'[1 2]',
+    b'[1, 2] 3',
+])
+def test_iter_json_array_rejects_bad_bodies(raw):
+    with pytest.raises(json.JSONDecodeError):
+        parse(raw, 3)
+
+def test_iter_json_array_raises_before_reading_everything():
+    class Stream(io.BytesIO):
+        reads = 0
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    stream = Stream(b'[{"a": 1}, {"a": x}, ' + b'{"b": 2}, ' * 10000 + b'{}]')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(stream, 64))
+    assert stream.reads < 5
+
+@pytest.mark.parametrize('bad', [b'x', b'1e+x', b'tx', b'"\\u12x"', b'1]'])
+def test_iter_json_array_raises_near_end_of_read(bad):
+    """Malformed values just before the end of a read are not mistaken for cut ones"""
+    class Stream(io.BytesIO):
+        reads = 0
+        def read(self, size=-1):
+            self.reads += 1
+            return super().read(size)
+
+    # the bad value ends two characters before the end of the first read
+    head = b'[{"a": ' + bad + b'}'
+    stream = Stream(head + b'  ' + b', {}' * 10000 + b']')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(stream, len(head) + 2))
+    assert stream.reads == 1
+
+def test_search_description():
+    results = [
+        Apod('a', 'image', 'x'),
+        Apod('v', 'video', 'earth sky'),
+        Apod('b', 'image', 'Earth'),
+        Apod('c', 'image', 'earth and sky'),
+        Apod('d', 'image', 'sky'),
+        Apod('e', 'image', 'nothing'),
+    ]
+    assert search_description(iter(results), 'earth sky', 3) == ['c', 'b', 'd']
+    assert search_description(iter(results), 'nebula') == ['a', 'b']
+
+def test_search_description_duplicate_urls():
+    results = [Apod('a', 'image', 'x'), Apod('b', 'image', 'foo'), Apod('c', 'image', 'foo'), Apod('a', 'image', 'foo')]
+    assert search_description(iter(results), 'foo') == ['a', 'b']
+
+def test_photomosaic_keeps_target_shape():
+    # tall stamps give tall tiles, cropped rather than squashed
+    stamps = [solid(color, 4, 6) for color in [(0, 0, 0), (255, 255, 255)]] + [solid((255, 0, 0), 6, 6)]
+    tiles, tree = build_library(stamps, 4)
+    assert {(tile.width, tile.height) for tile in tiles} == {(4, 6)}
+
+    # 800x1200 target, black on top and white below
+    target = SimpleImage.blank(800, 1200)
+    target.pil_image.paste((0, 0, 0), (0, 0, 800, 600))
+
+    mosaic = photomosaic(target, tiles, tree, columns=10)
+    assert (mosaic.width, mosaic.height) == (40, 60)
+    assert mosaic.pil_image.getpixel((0, 0)) == (0, 0, 0)
+    assert mosaic.pil_image.getpixel((39, 59)) == (255, 255, 255)